@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Local translation memory: a small SQLite cache in front of DeepL.
+
+Entries are keyed by sha256(src|tgt|glossary_id|options|text), so re-running a
+document (e.g. while tuning the glossary) only pays for text that changed.
+Changing the glossary changes its id, which naturally misses the cache.
+
+- DB lives at ~/.cache/epd-translation/tm.sqlite (WAL mode)
+- Entries expire after TTL_SECONDS; expired rows are purged (and the file
+  vacuumed) at most once per PURGE_INTERVAL
+- Best effort: if the DB can't be opened or written (read-only HOME, locked
+  file), lookups miss and stores are skipped; translation carries on uncached
+"""
+
+import hashlib
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+CACHE_PATH = Path.home() / ".cache" / "epd-translation" / "tm.sqlite"
+TTL_SECONDS = 30 * 24 * 3600      # re-translate entries older than 30 days
+PURGE_INTERVAL = 7 * 24 * 3600    # drop expired rows + VACUUM at most weekly
+_SQL_BATCH = 500                  # stay below SQLite's bound-parameter limit
+
+_conn: Optional[sqlite3.Connection] = None
+_disabled = False  # set after the first failure; the cache is skipped from then on
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(CACHE_PATH))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        _purge_expired(conn)
+        _conn = conn
+    return _conn
+
+
+def _disable(e: Exception) -> None:
+    global _disabled
+    if not _disabled:
+        print(f"Warning: translation memory unavailable ({e}); continuing without it.", file=sys.stderr)
+    _disabled = True
+
+
+def _purge_expired(conn: sqlite3.Connection) -> None:
+    now = time.time()
+    row = conn.execute("SELECT value FROM meta WHERE name = 'last_purge'").fetchone()
+    if row and now - row[0] < PURGE_INTERVAL:
+        return
+    with conn:
+        conn.execute("DELETE FROM tm WHERE created < ?", (now - TTL_SECONDS,))
+        conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('last_purge', ?)", (now,))
+    conn.execute("VACUUM")
+
+
+def cache_key(text: str, src: str, tgt: str, glossary_id: Optional[str], options: str = "") -> str:
+    """`options` distinguishes requests whose output differs for the same text (e.g. HTML mode)."""
+    raw = f"{src.upper()}|{tgt.upper()}|{glossary_id or ''}|{options}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lookup_many(texts: Iterable[str], src: str, tgt: str, glossary_id: Optional[str],
+                options: str = "") -> Dict[str, str]:
+    """Return {text: cached translation} for the texts that are cached and not expired."""
+    keys = {cache_key(t, src, tgt, glossary_id, options): t for t in texts}
+    if not keys or _disabled:
+        return {}
+    cutoff = time.time() - TTL_SECONDS
+    found: Dict[str, str] = {}
+    key_list = list(keys)
+    try:
+        conn = _connect()
+        for i in range(0, len(key_list), _SQL_BATCH):
+            part = key_list[i:i + _SQL_BATCH]
+            marks = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT key, text FROM tm WHERE created >= ? AND key IN ({marks})", (cutoff, *part)
+            )
+            for key, translated in rows:
+                found[keys[key]] = translated
+    except (sqlite3.Error, OSError) as e:
+        _disable(e)
+        return {}
+    return found
+
+
+def store_many(translations: Dict[str, str], src: str, tgt: str, glossary_id: Optional[str],
+               options: str = "") -> None:
+    """Store {source text: translation} pairs."""
+    if not translations or _disabled:
+        return
+    now = time.time()
+    try:
+        conn = _connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tm (key, text, created) VALUES (?, ?, ?)",
+                [(cache_key(s, src, tgt, glossary_id, options), t, now) for s, t in translations.items()],
+            )
+    except (sqlite3.Error, OSError) as e:
+        _disable(e)
+
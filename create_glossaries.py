@@ -17,11 +17,13 @@ import csv
 import io
 import re
 import sys
+import json
+import argparse
 import requests
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
 
-import deepl
+import deepl_client
 
 
 # ---- CONFIG: language columns and their DeepL codes --------------------------
@@ -68,62 +70,129 @@ def google_edit_url_to_csv_url(edit_url: str) -> str:
     return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
 
 
-def fetch_csv_text(csv_url: str) -> str:
+SHEET_CACHE_CSV = ".sheet_cache.csv"
+SHEET_CACHE_META = ".sheet_cache.meta.json"
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write via a temp file + os.replace so a crash never leaves a half-written cache."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def fetch_csv_cached(csv_url: str, cache_dir: Path = Path("glossaries"), force_refresh: bool = False) -> str:
     """
-    Fetch CSV text from a (public) Google Sheets export URL.
+    Fetch CSV text from a (public) Google Sheets export URL, revalidating a local copy.
+    The last download is kept in cache_dir together with its ETag/Last-Modified headers;
+    if Google answers 304 Not Modified, the cached text is returned without re-downloading.
     If your sheet is private, either publish-to-web (CSV) or use Google API auth instead.
     """
-    resp = requests.get(csv_url, timeout=30)
+    csv_path = cache_dir / SHEET_CACHE_CSV
+    meta_path = cache_dir / SHEET_CACHE_META
+
+    meta: Dict[str, str] = {}
+    if not force_refresh and csv_path.exists() and meta_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except ValueError:
+            meta = {}
+        if meta.get("url") != csv_url:
+            meta = {}
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp = requests.get(csv_url, headers=headers, timeout=30)
+    if resp.status_code == 304 and headers:
+        print("Sheet unchanged since last run; using cached CSV.")
+        return csv_path.read_text(encoding="utf-8")
     resp.raise_for_status()
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _atomic_write_text(csv_path, resp.text)
+    _atomic_write_text(meta_path, json.dumps({
+        "url": csv_url,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }))
     return resp.text
 
 
-def read_rows_from_csv_text(csv_text: str) -> List[Dict[str, str]]:
-    """Parse CSV into a list of dict rows (header-driven)."""
-    buf = io.StringIO(csv_text)
-    reader = csv.DictReader(buf)
-    return [row for row in reader]
+def read_columns_from_csv_text(csv_text: str) -> Dict[str, List[Optional[str]]]:
+    """Parse CSV into {header: column values} (one list per column, rows aligned by index).
+    Cells missing from short rows are None, as with csv.DictReader."""
+    reader = csv.reader(io.StringIO(csv_text))
+    header = next(reader, [])
+    cols: List[List[Optional[str]]] = [[] for _ in header]
+    for row in reader:
+        if not row:
+            continue  # blank line
+        row += [None] * (len(header) - len(row))  # short rows: missing cells are None
+        for col, val in zip(cols, row):
+            col.append(val)
+    return dict(zip(header, cols))
+
+
+_TRUTHY = frozenset(("true", "1", "yes", "y", "x"))  # allow 'x' as in your screenshot
 
 
 def truthy(val: Optional[str]) -> bool:
     if val is None:
         return True  # If no Active column, treat as active
-    s = str(val).strip().lower()
-    return s in ("true", "1", "yes", "y", "x")  # allow 'x' as in your screenshot
+    return bool(val) and val.strip().lower() in _TRUTHY
+
+
+def active_mask(cols: Dict[str, List[Optional[str]]]) -> Optional[List[bool]]:
+    """Per-row ACTIVE_COL flags (a missing cell counts as active), or None if the sheet
+    has no such column (all rows active)."""
+    if ACTIVE_COL not in cols:
+        return None
+    return list(map(truthy, cols[ACTIVE_COL]))
 
 
-def build_pairs(rows: List[Dict[str, str]], src_col: str, tgt_col: str) -> Dict[str, str]:
-    """Build a mapping src->tgt using the given column names, honoring ACTIVE_COL if present."""
+def build_pairs(cols: Dict[str, List[Optional[str]]], src_col: str, tgt_col: str,
+                active: Optional[List[bool]] = None) -> Dict[str, str]:
+    """Build a mapping src->tgt from two columns, keeping only rows flagged in `active` (if given)."""
+    rows = zip(cols.get(src_col, []), cols.get(tgt_col, []))
+    if active is not None:
+        rows = (r for r, a in zip(rows, active) if a)
     pairs: Dict[str, str] = {}
-    for r in rows:
-        if ACTIVE_COL in r and not truthy(r.get(ACTIVE_COL)):
-            continue
-        src = (r.get(src_col) or "").strip()
-        tgt = (r.get(tgt_col) or "").strip()
-        if src and tgt:
-            pairs[src] = tgt
+    for s, t in rows:
+        s, t = (s or "").strip(), (t or "").strip()
+        if s and t:
+            pairs[s] = t
     return pairs
 
 
-def ensure_glossary(translator, name: str, source_lang: str, target_lang: str, pairs: dict):
+def ensure_glossary(api_key: str, name: str, source_lang: str, target_lang: str, pairs: dict) -> str:
+    """Create or refresh glossary `name`; returns its ID (also recorded in the sidecar file)."""
+    translator = deepl_client.get_translator(api_key)
     # try to find existing glossary
-    for g in translator.list_glossaries():
-        if g.name == name and g.source_lang.upper() == source_lang.upper() and g.target_lang.upper() == target_lang.upper():
-            # update if API supports it; otherwise delete+recreate
-            try:
-                translator.set_glossary_entries(g, entries=pairs)  # new SDKs
-                return g
-            except AttributeError:
-                translator.delete_glossary(g.glossary_id)          # old SDKs
-                break
-
-    # create new (or after delete)
-    return translator.create_glossary(
+    found = deepl_client.find_first_glossary(api_key, [name], source_lang, target_lang)
+    if found is not None:
+        glossary_id = found[1]
+        # update if API supports it; otherwise delete+recreate
+        try:
+            translator.set_glossary_entries(glossary_id, entries=pairs)  # new SDKs
+            deepl_client.remember_glossary_id(name, source_lang, target_lang, glossary_id)
+            return glossary_id
+        except AttributeError:
+            translator.delete_glossary(glossary_id)          # old SDKs
+
+    # create new (or after delete); the cached listing is stale from here on
+    deepl_client.forget_glossary_listing()
+    g = translator.create_glossary(
         name=name,
         source_lang=source_lang,
         target_lang=target_lang,
         entries=pairs,  # dict of source->target
     )
+    deepl_client.remember_glossary_id(name, source_lang, target_lang, g.glossary_id)
+    return g.glossary_id
 
 
 def save_pairs_to_csv(pairs: dict, src: str, tgt: str, folder: Path = Path("glossaries")):
@@ -138,31 +207,32 @@ def save_pairs_to_csv(pairs: dict, src: str, tgt: str, folder: Path = Path("glos
     print(f"Saved local glossary CSV: {out_path}")
 
 def main():
+    ap = argparse.ArgumentParser(description="Create/refresh DeepL glossaries from a Google Sheet.")
+    ap.add_argument("edit_url", help="Google Sheet edit URL")
+    ap.add_argument("--force-refresh", action="store_true",
+                    help="Ignore the cached sheet CSV and download it again")
+    args = ap.parse_args()
+
     if "DEEPL_API_KEY" not in os.environ:
         print("Error: set DEEPL_API_KEY in your environment.")
         sys.exit(1)
 
-    if len(sys.argv) < 2:
-        print("Usage: python create_glossaries_from_sheet.py <google_sheet_edit_url>")
-        sys.exit(1)
-
-    edit_url = sys.argv[1]
-    csv_url = google_edit_url_to_csv_url(edit_url)
+    csv_url = google_edit_url_to_csv_url(args.edit_url)
     print(f"Fetching CSV from: {csv_url}")
 
     try:
-        csv_text = fetch_csv_text(csv_url)
+        csv_text = fetch_csv_cached(csv_url, force_refresh=args.force_refresh)
     except Exception as e:
         print(f"Error fetching CSV: {e}")
         sys.exit(1)
 
-    rows = read_rows_from_csv_text(csv_text)
-    if not rows:
+    cols = read_columns_from_csv_text(csv_text)
+    if not cols or not next(iter(cols.values())):
         print("No rows found in CSV (empty or headers missing).")
         sys.exit(1)
 
     # Validate required columns exist
-    headers = set(rows[0].keys())
+    headers = set(cols.keys())
     missing = [col for col in LANG_COLUMNS.values() if col not in headers]
     if len(missing) == len(LANG_COLUMNS):
         print(f"Error: none of the language columns were found. Expected any of: {list(LANG_COLUMNS.values())}")
@@ -170,19 +240,20 @@ def main():
     elif missing:
         print(f"Warning: missing columns (will skip directions involving them): {missing}")
 
-    translator = deepl.Translator(os.environ["DEEPL_API_KEY"])
+    api_key = os.environ["DEEPL_API_KEY"]
+    active = active_mask(cols)  # computed once, shared by every language pair
 
         # --- Only allow EN->DE glossary for now ---
     src, tgt = "EN", "DE"
     src_col, tgt_col = LANG_COLUMNS[src], LANG_COLUMNS[tgt]
-    pairs = build_pairs(rows, src_col=src_col, tgt_col=tgt_col)
+    pairs = build_pairs(cols, src_col=src_col, tgt_col=tgt_col, active=active)
     if pairs:
         save_pairs_to_csv(pairs, src, tgt)  # keep local CSV copy
         name = GLOSSARY_NAME.format(src=src, tgt=tgt)
         print(f"Syncing glossary '{name}' ({src}->{tgt}) with {len(pairs)} entries...")
-        g = ensure_glossary(translator, name=name,
-                            source_lang=src, target_lang=tgt, pairs=pairs)
-        print(f"Glossary ready: {name} (id={g.glossary_id})")
+        glossary_id = ensure_glossary(api_key, name=name,
+                                      source_lang=src, target_lang=tgt, pairs=pairs)
+        print(f"Glossary ready: {name} (id={glossary_id})")
     else:
         print("No EN->DE pairs found, nothing to sync.")
 
@@ -197,7 +268,7 @@ def main():
     #             continue
     #         src_col = LANG_COLUMNS[src]
     #         tgt_col = LANG_COLUMNS[tgt]
-    #         pairs = build_pairs(rows, src_col=src_col, tgt_col=tgt_col)
+    #         pairs = build_pairs(cols, src_col=src_col, tgt_col=tgt_col, active=active)
     #         if not pairs:
     #             continue
 
@@ -207,8 +278,8 @@ def main():
     #         # Push/update to DeepL
     #         name = GLOSSARY_NAME.format(src=src, tgt=tgt)
     #         print(f"Syncing glossary '{name}' ({src}->{tgt}) with {len(pairs)} entries...")
-    #         g = ensure_glossary(translator, name=name, source_lang=src, target_lang=tgt, pairs=pairs)
-    #         created_or_updated.append((name, g.glossary_id, f"{src}->{tgt}"))
+    #         glossary_id = ensure_glossary(api_key, name=name, source_lang=src, target_lang=tgt, pairs=pairs)
+    #         created_or_updated.append((name, glossary_id, f"{src}->{tgt}"))
 
     # if not created_or_updated:
     #     print("No glossaries created/updated (no valid pairs found).")
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Shared DeepL plumbing for the translation scripts and create_glossaries.py.
+
+- One Translator per process (one HTTP session), closed at exit
+- 429/5xx are retried by the SDK itself; a connection still failing after
+  that gets one more round after a pause
+- Glossary IDs looked up by language pair, with fallback names for "auto";
+  the sidecar file written by create_glossaries.py is checked first where wanted
+- Texts deduplicated, served from the translation memory (cache.py) where
+  possible, and the rest sent as concurrent multi-text requests
+
+deepl itself is imported on first use, so importing this module stays cheap.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import os
+import random
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    import deepl
+
+import cache
+
+# DeepL accepts up to 50 texts and 128 KiB of request body per translate call. The SDK
+# posts the body as ASCII-escaped JSON, so non-ASCII text costs 6 bytes per character
+# (12 outside the BMP) and quotes/newlines 2; sizes are measured in that encoding.
+MAX_TEXTS_PER_REQUEST = 50
+MAX_BYTES_PER_REQUEST = 120_000  # leave headroom for the other request fields
+MAX_PARALLEL_REQUESTS = 5  # default cap on requests in flight at once (DeepL rate-limits bursts)
+
+# The SDK already retries 429 and 5xx answers and retryable connection errors itself
+# (deepl.http_client.max_network_retries = 5 retries, ~16 s of backoff). On top of that,
+# a retryable ConnectionException the SDK gave up on gets RETRY_ATTEMPTS - 1 more rounds
+# after a jittered pause. Worst case per call: 2 x 6 = 12 HTTP attempts over roughly 40 s of
+# sleeping, plus the request timeouts.
+RETRY_ATTEMPTS = 2
+RETRY_BASE_DELAY = 5.0  # seconds; doubles per attempt
+RETRY_MAX_DELAY = 30.0
+
+# Glossary names tried in order for --glossary auto.
+AUTO_GLOSSARY_NAMES = ["epd-{src}-{tgt}", "{src}-{tgt}", "{src}_{tgt}"]
+
+T = TypeVar("T")
+
+
+def resolve_target_lang(tgt: str, en_variant: str) -> str:
+    """DeepL uses EN-GB/EN-US for English; other languages are just their code."""
+    t = tgt.upper()
+    if t == "EN":
+        return en_variant.upper()  # EN-GB or EN-US
+    return t
+
+
+def with_retry(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Call fn, retrying connection failures the SDK gave up on, with jittered backoff."""
+    import deepl
+
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except deepl.ConnectionException as e:
+            # should_retry=False marks failures a resend won't fix (e.g. a malformed request)
+            if not e.should_retry or attempt == RETRY_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+    raise AssertionError("unreachable")
+
+
+@lru_cache(maxsize=1)
+def get_translator(api_key: str) -> deepl.Translator:
+    """Single Translator for the process (one HTTP session, one TLS handshake)."""
+    import deepl
+
+    translator = deepl.Translator(api_key)
+    atexit.register(translator.close)  # release the pooled connections on exit
+    return translator
+
+
+# ---------- Glossaries ----------
+# Sidecar of known glossary IDs ("name|SRC|TGT" -> id), written by create_glossaries.py
+# so that a lookup usually needs no list_glossaries() round trip.
+GLOSSARY_IDS_FILE = Path("glossaries") / ".glossary_ids.json"
+
+
+def load_glossary_ids(path: Path = GLOSSARY_IDS_FILE) -> Dict[str, str]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _glossary_key(name: str, src: str, tgt: str) -> str:
+    return f"{name}|{src.upper()}|{tgt.upper()}"
+
+
+def remember_glossary_id(name: str, src: str, tgt: str, glossary_id: Optional[str],
+                         path: Path = GLOSSARY_IDS_FILE) -> None:
+    """Merge one glossary ID into the sidecar file (None removes the entry)."""
+    ids = load_glossary_ids(path)
+    if glossary_id is None:
+        if ids.pop(_glossary_key(name, src, tgt), None) is None:
+            return
+    else:
+        ids[_glossary_key(name, src, tgt)] = glossary_id
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")  # temp file + os.replace: never half-written
+    tmp.write_text(json.dumps(ids, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=8)
+def _glossaries_by_pair(api_key: str) -> Dict[Tuple[str, str], Dict[str, str]]:
+    """(SRC, TGT) -> {name: glossary_id} for the account, fetched once per process."""
+    index: Dict[Tuple[str, str], Dict[str, str]] = {}
+    for g in with_retry(get_translator(api_key).list_glossaries):
+        index.setdefault((g.source_lang.upper(), g.target_lang.upper()), {})[g.name] = g.glossary_id
+    return index
+
+
+def forget_glossary_listing() -> None:
+    """Drop the cached list_glossaries() result (after creating or deleting a glossary)."""
+    _glossaries_by_pair.cache_clear()
+
+
+def glossary_candidates(name: str, src: str, tgt: str) -> List[str]:
+    """Names to try for a --glossary value: the fallback chain for "auto", else just `name`."""
+    if name.lower() == "auto":
+        return [n.format(src=src.upper(), tgt=tgt.upper()) for n in AUTO_GLOSSARY_NAMES]
+    return [name]
+
+
+def find_first_glossary(api_key: str, names: List[str], src: str, tgt: str) -> Optional[Tuple[str, str]]:
+    """(name, glossary_id) of the first of `names` that exists for src->tgt."""
+    by_name = _glossaries_by_pair(api_key).get((src.upper(), tgt.upper()), {})
+    for name in names:
+        if name in by_name:
+            return name, by_name[name]
+    return None
+
+
+def find_first_glossary_cached(api_key: str, names: List[str], src: str, tgt: str) -> Optional[Tuple[str, str]]:
+    """find_first_glossary, but answered from the sidecar file when it knows one of `names`."""
+    ids = load_glossary_ids()
+    for name in names:
+        glossary_id = ids.get(_glossary_key(name, src, tgt))
+        if glossary_id:
+            return name, glossary_id
+    return find_first_glossary(api_key, names, src, tgt)
+
+
+def _is_glossary_error(e: deepl.DeepLException) -> bool:
+    """True if DeepL rejected the glossary itself (unknown ID, wrong language pair)."""
+    return e.http_status_code == 404 or (e.http_status_code == 400 and "glossary" in str(e).lower())
+
+
+def call_with_glossary(
+    fn: Callable[[Optional[str]], T],
+    api_key: str,
+    found: Optional[Tuple[str, str]],
+    src: str,
+    tgt: str,
+) -> T:
+    """Call fn(glossary_id) for a find_first_glossary_cached() result.
+
+    A sidecar entry outlives its glossary when the glossary is deleted or recreated
+    elsewhere. If DeepL rejects the glossary (404, or a 400 about the glossary), the
+    entry is dropped, the name is looked up again and fn retried once with the
+    current ID; failing that, fn runs without a glossary. Other errors propagate.
+    """
+    import deepl
+
+    if found is None:
+        return fn(None)
+    name, glossary_id = found
+    try:
+        return fn(glossary_id)
+    except deepl.DeepLException as e:
+        if not _is_glossary_error(e):
+            raise
+        error = e
+
+    if load_glossary_ids().get(_glossary_key(name, src, tgt)) == glossary_id:
+        remember_glossary_id(name, src, tgt, None)
+        forget_glossary_listing()
+        try:
+            fresh = find_first_glossary(api_key, [name], src, tgt)
+        except deepl.DeepLException:
+            fresh = None
+        if fresh is not None and fresh[1] != glossary_id:
+            remember_glossary_id(name, src, tgt, fresh[1])
+            try:
+                return fn(fresh[1])
+            except deepl.DeepLException as e:
+                if not _is_glossary_error(e):
+                    raise
+                error = e
+
+    print(f"Warning: DeepL rejected glossary '{name}' ({error}); continuing without it.", file=sys.stderr)
+    return fn(None)
+
+
+# ---------- Translation ----------
+def encoded_size(text: str) -> int:
+    """Bytes `text` adds to a request body: escaped, quoted, plus the ", " separator."""
+    return len(json.dumps(text)) + 2
+
+
+def batch_texts(
+    texts: List[str],
+    max_texts: int = MAX_TEXTS_PER_REQUEST,
+    max_bytes: int = MAX_BYTES_PER_REQUEST,
+) -> List[List[str]]:
+    """Group texts into batches that each fit in a single DeepL request."""
+    batches: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for text in texts:
+        n = encoded_size(text)
+        if current and (len(current) >= max_texts or size + n > max_bytes):
+            batches.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def raise_first(results: list) -> None:
+    """Re-raise the first exception in a gather(..., return_exceptions=True) result."""
+    for res in results:
+        if isinstance(res, BaseException):
+            raise res
+
+
+async def translate_many_async(
+    texts: List[str],
+    translator: deepl.Translator,
+    src: str,
+    target: str,
+    glossary_id: Optional[str],
+    *,
+    sem: asyncio.Semaphore,
+    concurrency: int = MAX_PARALLEL_REQUESTS,
+    options: str = "",
+    split: Optional[Callable[[str], List[str]]] = None,
+    **kwargs,
+) -> Dict[str, str]:
+    """Translate `texts`, returning {text: translation} for each distinct text.
+
+    Texts translated by an earlier run come from the translation memory; the rest
+    are sent in batches with at most `sem` requests in flight. `kwargs` go to
+    Translator.translate_text (e.g. tag_handling) and `options` must describe them
+    for the cache key. A request over MAX_BYTES_PER_REQUEST, or one DeepL rejects
+    as too large (413), is halved; a single text that is still too large is broken
+    by `split` into paragraphs that are translated separately and rejoined with
+    blank lines (without `split` the 413 propagates).
+    """
+    import deepl
+
+    unique = list(dict.fromkeys(texts))
+    table = cache.lookup_many(unique, src, target, glossary_id, options)
+    todo = [t for t in unique if t not in table]
+    concurrency = max(1, concurrency)
+    per_batch = min(MAX_TEXTS_PER_REQUEST, -(-len(todo) // concurrency))  # ceil division
+    batches = batch_texts(todo, max_texts=per_batch)
+
+    async def halve(batch: List[str]) -> Optional[List[str]]:
+        """Translate `batch` as two smaller requests: first the batch, then the text itself."""
+        if len(batch) > 1:
+            mid = len(batch) // 2
+            return await translate_batch(batch[:mid]) + await translate_batch(batch[mid:])
+        pieces = split(batch[0]) if split else []
+        if len(pieces) < 2:
+            return None
+        return ["\n\n".join(await translate_batch(pieces))]
+
+    async def translate_batch(batch: List[str]) -> List[str]:
+        if sum(map(encoded_size, batch)) > MAX_BYTES_PER_REQUEST:  # DeepL would answer 413
+            halved = await halve(batch)
+            if halved is not None:
+                return halved
+        try:
+            async with sem:
+                # one request per batch; DeepL returns results in input order.
+                # The SDK is blocking, so each request runs in a worker thread.
+                results = await asyncio.to_thread(
+                    with_retry,
+                    translator.translate_text,
+                    batch,
+                    source_lang=src.upper(),
+                    target_lang=target,
+                    glossary=glossary_id,  # None is fine if not found
+                    **kwargs,
+                )
+        except deepl.DeepLException as e:
+            if e.http_status_code != 413:  # only "request too large" is worth splitting
+                raise
+            halved = await halve(batch)
+            if halved is None:
+                raise
+            return halved
+        return [r.text for r in results]
+
+    # let every request settle before surfacing the first failure
+    translated = await asyncio.gather(*(translate_batch(b) for b in batches), return_exceptions=True)
+    raise_first(translated)
+
+    # gather keeps input order, so batches line up with `todo`
+    fresh = dict(zip(todo, (t for batch in translated for t in batch)))
+    cache.store_many(fresh, src, target, glossary_id, options)
+    table.update(fresh)
+    return table
+
+
+def translate_many(
+    texts: List[str],
+    translator: deepl.Translator,
+    src: str,
+    target: str,
+    glossary_id: Optional[str],
+    *,
+    concurrency: int = MAX_PARALLEL_REQUESTS,
+    options: str = "",
+    split: Optional[Callable[[str], List[str]]] = None,
+    **kwargs,
+) -> List[str]:
+    """Blocking translate_many_async; translations are returned in the order of `texts`."""
+    async def run() -> Dict[str, str]:
+        sem = asyncio.Semaphore(max(1, concurrency))
+        return await translate_many_async(
+            texts, translator, src, target, glossary_id,
+            sem=sem, concurrency=concurrency, options=options, split=split, **kwargs,
+        )
+
+    table = asyncio.run(run())
+    return [table[t] for t in texts]
@@ -1,24 +1,37 @@
 #!/usr/bin/env python3
 """
-Render Jinja -> HTML, optionally translate HTML with DeepL, then HTML -> PDF via weasyprint.
+Render Jinja -> HTML, optionally translate HTML with DeepL, then HTML -> PDF via weasyprint
+(or a headless Chromium through Playwright, with --pdf-engine chromium).
 """
 
 from __future__ import annotations
 import os, json, argparse, subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
-from jinja2 import Environment, FileSystemLoader, select_autoescape, StrictUndefined
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape, StrictUndefined
 import deepl
-from weasyprint import HTML
+
+import deepl_client
+
+try:
+    import orjson  # parses the --data file straight from bytes; optional
+except ImportError:
+    orjson = None
 
 IGNORE_TAGS = ["script", "style", "code", "pre"]  # do not translate these blocks
+JINJA_CACHE_DIR = Path.home() / ".cache" / "epd-jinja"  # compiled templates, reused across runs
 
 # ---------- Rendering ----------
 def build_env(templates_dir: Path) -> Environment:
+    JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
     return Environment(
         loader=FileSystemLoader(str(templates_dir)),
         autoescape=select_autoescape(["html", "j2"]),
         undefined=StrictUndefined,  # fail if a variable is missing
+        # skip parse+compile when the template source is unchanged since the last run
+        bytecode_cache=FileSystemBytecodeCache(str(JINJA_CACHE_DIR)),
+        auto_reload=False,  # one render per process; no need to re-stat templates
     )
 
 def render_template(env: Environment, template_name: str, context: dict) -> str:
@@ -26,22 +39,12 @@ def render_template(env: Environment, template_name: str, context: dict) -> str:
     return tpl.render(**context)
 
 # ---------- DeepL translation ----------
-def _resolve_target(tgt: str, en_variant: str) -> str:
-    return en_variant if tgt.upper() == "EN" else tgt.upper()
-
-def find_glossary_id(translator: deepl.Translator, name: str, src: str, tgt: str) -> Optional[str]:
-    s, t = src.upper(), tgt.upper()
-    for g in translator.list_glossaries():
-        if g.name == name and g.source_lang.upper() == s and g.target_lang.upper() == t:
-            return g.glossary_id
-    return None
-
-def translate_html(html: str, *, api_key: str, src: str, tgt: str, glossary_id: Optional[str], en_variant: str) -> str:
-    tr = deepl.Translator(api_key)
-    res = tr.translate_text(
+def translate_html(html: str, *, translator: deepl.Translator, src: str, tgt: str, glossary_id: Optional[str], en_variant: str) -> str:
+    res = deepl_client.with_retry(
+        translator.translate_text,
         html,
         source_lang=src.upper(),
-        target_lang=_resolve_target(tgt, en_variant),
+        target_lang=deepl_client.resolve_target_lang(tgt, en_variant),
         tag_handling="html",
         ignore_tags=IGNORE_TAGS,
         glossary=glossary_id,  # ok if None
@@ -49,8 +52,56 @@ def translate_html(html: str, *, api_key: str, src: str, tgt: str, glossary_id:
     return res.text if hasattr(res, "text") else res[0].text
 
 # ---------- PDF ----------
-def html_to_pdf(input_html_path, output_pdf_path):
-    HTML(filename=str(input_html_path)).write_pdf(str(output_pdf_path))
+# Engine startup (WeasyPrint's font/CSS setup, launching Chromium) costs far more
+# than a single render, so a renderer is created once and reused for every PDF.
+class WeasyPrintRenderer:
+    def __init__(self):
+        from weasyprint import HTML  # slow import; only paid when a PDF is wanted
+        self._html = HTML
+
+    def render(self, input_html_path, output_pdf_path):
+        self._html(filename=str(input_html_path)).write_pdf(str(output_pdf_path))
+
+    def close(self):
+        pass
+
+class ChromiumRenderer:
+    def __init__(self):
+        from playwright.sync_api import sync_playwright
+        self._playwright = sync_playwright().start()
+        try:
+            self._browser = self._playwright.chromium.launch()
+            self._page = self._browser.new_page()
+        except Exception:
+            self._playwright.stop()  # also ends a browser that did start
+            raise
+
+    def render(self, input_html_path, output_pdf_path):
+        self._page.goto(Path(input_html_path).resolve().as_uri())
+        self._page.pdf(path=str(output_pdf_path), format="A4", print_background=True)
+
+    def close(self):
+        self._browser.close()
+        self._playwright.stop()
+
+def open_renderer(engine: str = "weasyprint"):
+    if engine == "chromium":
+        try:
+            return ChromiumRenderer()
+        except ImportError:
+            print("Playwright not installed; falling back to weasyprint.")
+        except Exception as e:
+            from playwright.sync_api import Error as PlaywrightError
+            if not isinstance(e, PlaywrightError):
+                raise
+            # typically the browser was never downloaded (`playwright install chromium`)
+            print(f"Chromium could not be started ({e}); falling back to weasyprint.")
+    return WeasyPrintRenderer()
+
+def html_to_pdf(input_html_path, output_pdf_path, renderer=None):
+    if renderer is None:
+        renderer = WeasyPrintRenderer()
+    renderer.render(input_html_path, output_pdf_path)
 
 # ---------- CLI ----------
 def main():
@@ -63,7 +114,9 @@ def main():
     ap.add_argument("--src", default="EN", help="Source language (default: EN)")
     ap.add_argument("--tgt", default="DE", help="Target language (default: DE)")
     ap.add_argument("--en-variant", default="EN-GB", choices=["EN-GB", "EN-US"], help="English variant if tgt=EN")
-    ap.add_argument("--glossary", default="none", help='Glossary name (e.g. "epd-EN-DE"), or "auto", or "none"')
+    ap.add_argument("--glossary", default="none", help='Glossary name (e.g. "epd-EN-DE"), or "auto" (epd-<SRC>-<TGT>, then <SRC>-<TGT>, <SRC>_<TGT>), or "none"')
+    ap.add_argument("--pdf-engine", default="weasyprint", choices=["weasyprint", "chromium"],
+                    help="HTML -> PDF engine (default: weasyprint; chromium needs playwright)")
     args = ap.parse_args()
 
     templates_dir = Path(args.templates_dir).resolve()
@@ -90,7 +143,19 @@ def main():
         },
     }
     if args.data:
-        context = json.loads(Path(args.data).read_text(encoding="utf-8"))
+        if orjson is not None:
+            context = orjson.loads(Path(args.data).read_bytes())
+        else:
+            context = json.loads(Path(args.data).read_text(encoding="utf-8"))
+
+    # Start the glossary lookup (possibly a DeepL round trip) now so it overlaps rendering.
+    lookup_pool = ThreadPoolExecutor(max_workers=1)
+    glossary_fut = None
+    api_key = os.environ.get("DEEPL_API_KEY")
+    if args.translate and api_key and args.glossary.lower() != "none":
+        names = deepl_client.glossary_candidates(args.glossary, args.src, args.tgt)
+        glossary_fut = lookup_pool.submit(deepl_client.find_first_glossary_cached, api_key, names, args.src, args.tgt)
+    lookup_pool.shutdown(wait=False)  # no further submissions; the lookup keeps running
 
     # 1) Render Jinja -> HTML (source language HTML)
     env = build_env(templates_dir)
@@ -103,29 +168,32 @@ def main():
 
     # 2) (Optional) Translate HTML
     if args.translate:
-        api_key = os.environ.get("DEEPL_API_KEY")
         if not api_key:
             raise SystemExit("Set DEEPL_API_KEY to translate.")
+        translator = deepl_client.get_translator(api_key)  # one instance = one pooled HTTPS connection
 
-        glossary_id = None
-        if args.glossary.lower() != "none":
-            name = f"epd-{args.src.upper()}-{args.tgt.upper()}" if args.glossary.lower() == "auto" else args.glossary
+        found = None
+        if glossary_fut is not None:
             try:
-                glossary_id = find_glossary_id(deepl.Translator(api_key), name, args.src, args.tgt)
-                if glossary_id:
+                found = glossary_fut.result()
+                if found:
+                    name, glossary_id = found
                     print(f"Using glossary {name} ({args.src}->{args.tgt})")
                 else:
-                    print(f"Note: glossary '{name}' not found; continuing without.")
+                    print(f"Note: glossary '{names[0]}' not found; continuing without.")
             except Exception as e:
                 print(f"Glossary lookup failed: {e} (continuing without).")
 
-        translated_html = translate_html(
-            rendered_html,
-            api_key=api_key,
-            src=args.src,
-            tgt=args.tgt,
-            glossary_id=glossary_id,
-            en_variant=args.en_variant,
+        translated_html = deepl_client.call_with_glossary(
+            lambda glossary_id: translate_html(
+                rendered_html,
+                translator=translator,
+                src=args.src,
+                tgt=args.tgt,
+                glossary_id=glossary_id,
+                en_variant=args.en_variant,
+            ),
+            api_key, found, args.src, args.tgt,
         )
         tgt_html_path = outdir / f"rendered_{args.tgt.lower()}.html"
         tgt_html_path.write_text(translated_html, encoding="utf-8")
@@ -135,11 +203,16 @@ def main():
     # 3) HTML -> PDF
     pdf_path = outdir / f"rendered_{('src' if html_for_pdf_path==src_html_path else args.tgt.lower())}.pdf"
     try:
-        html_to_pdf(html_for_pdf_path, pdf_path)
-        print(f"PDF → {pdf_path}")
-    except FileNotFoundError:
+        renderer = open_renderer(args.pdf_engine)
+    except (ImportError, OSError):  # weasyprint missing, or its native libs are
         print("weasyprint not found. Install it with Homebrew: brew install weasyprint")
         print(f"You can still open the HTML in a browser: {html_for_pdf_path}")
+        return
+    try:
+        html_to_pdf(html_for_pdf_path, pdf_path, renderer)
+        print(f"PDF → {pdf_path}")
+    finally:
+        renderer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -9,11 +9,20 @@ import re
 import ast
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from html import escape as html_escape, unescape as html_unescape
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 
 import deepl
 
+import deepl_client
+
+try:
+    import orjson  # much faster JSON encoding; optional
+except ImportError:
+    orjson = None
+
 
 # --------- 1) Jinja masking (preserve all Jinja exactly) ---------
 JINJA_PATTERNS = [
@@ -23,29 +32,17 @@ JINJA_PATTERNS = [
     (r"{{.*?}}", "EXPR"),                           # {{ expression }}
 ]
 
-def mask_jinja(src: str) -> tuple[str, Dict[str, str]]:
-    mapping: Dict[str, str] = {}
-    masked = src
-    counter = 0
-    # run in order; each pass replaces current matches with inert HTML elements
-    for pat, _ in JINJA_PATTERNS:
-        while True:
-            m = re.search(pat, masked, flags=re.DOTALL)
-            if not m:
-                break
-            key = f"J{counter:06d}"
-            placeholder = f'<x-jinja data-k="{key}"></x-jinja>'
-            mapping[key] = masked[m.start(): m.end()]
-            masked = masked[: m.start()] + placeholder + masked[m.end():]
-            counter += 1
-    return masked, mapping
+# One alternation, tried left to right at each position; prepare_template folds it
+# into TEMPLATE_RE so the whole template is masked in a single linear scan.
+JINJA_RE = re.compile(
+    "|".join(f"(?P<{name}>{pat})" for pat, name in JINJA_PATTERNS),
+    re.DOTALL,
+)
+
+UNMASK_RE = re.compile(r'<x-jinja data-k="(J\d{6})"></x-jinja>')
 
 def unmask_jinja(masked: str, mapping: Dict[str, str]) -> str:
-    return re.sub(
-        r'<x-jinja data-k="(J\d{6})"></x-jinja>',
-        lambda m: mapping[m.group(1)],
-        masked,
-    )
+    return UNMASK_RE.sub(lambda m: mapping[m.group(1)], masked)
 
 
 # --------- 2) Handle heading2/heading3 macro calls -------------
@@ -61,8 +58,11 @@ LITERAL_MACRO_RE = re.compile(
     re.DOTALL,
 )
 
+# `arg` may not cross "}}", so a call that doesn't end in ") }}" (e.g. a filtered
+# {{ heading2(title)|safe }}) is left to the plain EXPR mask instead of running on
+# to the next ") }}" in the file.
 ANY_MACRO_RE = re.compile(
-    r"{{\s*heading(?P<lvl>[23])\(\s*(?P<arg>.*?)\s*\)\s*}}",
+    r"{{\s*heading[23]\(\s*(?P<arg>(?:(?!}}).)*?)\s*\)\s*}}",
     re.DOTALL,
 )
 
@@ -71,130 +71,154 @@ STRING_LIT_RE = re.compile(
     re.DOTALL,
 )
 
-def replace_literal_heading_macros_with_tags(src: str) -> str:
-    out: List[str] = []
-    last = 0
-    for m in LITERAL_MACRO_RE.finditer(src):
-        out.append(src[last: m.start()])
-        lvl = m.group("lvl")
-        s_literal = m.group("string")
-        try:
-            content = ast.literal_eval(s_literal)
-        except Exception:
-            content = s_literal.strip("\"'")
-        out.append(f"<x-h{lvl}>{content}</x-h{lvl}>")
-        last = m.end()
-    out.append(src[last:])
-    return "".join(out)
+def _quote(text: str) -> str:
+    """Double-quoted string literal for text (JSON quoting is valid Jinja)."""
+    if orjson is not None:
+        return orjson.dumps(text).decode("utf-8")
+    return json.dumps(text, ensure_ascii=False)
+
+XH2_RE = re.compile(r"<x-h2>(.*?)</x-h2>", re.DOTALL)
+XH3_RE = re.compile(r"<x-h3>(.*?)</x-h3>", re.DOTALL)
+
+def _repl_h2(m: re.Match) -> str:
+    return "{{ heading2(" + _quote(m.group(1)) + ") }}"
+
+def _repl_h3(m: re.Match) -> str:
+    return "{{ heading3(" + _quote(m.group(1)) + ") }}"
 
 def restore_heading_tags_to_macros(html: str) -> str:
-    def repl_h2(m):
-        q = json.dumps(m.group(1))
-        return "{{ heading2(" + q + ") }}"
-    def repl_h3(m):
-        q = json.dumps(m.group(1))
-        return "{{ heading3(" + q + ") }}"
-    html = re.sub(r"<x-h2>(.*?)</x-h2>", repl_h2, html, flags=re.DOTALL)
-    html = re.sub(r"<x-h3>(.*?)</x-h3>", repl_h3, html, flags=re.DOTALL)
+    html = XH2_RE.sub(_repl_h2, html)
+    html = XH3_RE.sub(_repl_h3, html)
     return html
 
-def translate_string_literals_in_nonliteral_macros(
-    src: str,
-    translator: deepl.Translator,
-    source_lang: str,
-    target_lang: str,
-    en_variant: str,
-    glossary: Optional[str],
-) -> str:
-    # Gather literals inside heading2/3 where the arg is not a pure string
+
+# --------- 3) Single pass over the template -------------
+# One scan over the source does all preprocessing: literal heading macros become
+# <x-hN> tags, every other Jinja construct is masked, and the string literals of
+# non-literal heading macros are collected (those macros stay masked and are
+# rewritten in `mapping` once their literals are translated).
+TEMPLATE_RE = re.compile(
+    r"(?P<LITERAL_HEADING>" + LITERAL_MACRO_RE.pattern + r")"
+    r"|(?P<ANY_HEADING>" + ANY_MACRO_RE.pattern + r")"
+    r"|" + JINJA_RE.pattern,
+    re.DOTALL,
+)
+
+# (mapping key, [(literal start, literal end, literal token)]); offsets are
+# relative to the masked macro's source text mapping[key].
+MacroSpan = Tuple[str, List[Tuple[int, int, str]]]
+
+def _fast_unquote(lit: str) -> str:
+    """Value of a quoted string literal; only literals with escapes need the AST parser."""
+    if "\\" not in lit:
+        return lit[1:-1]
+    try:
+        return ast.literal_eval(lit)
+    except Exception:
+        return lit.strip("\"'")
+
+def prepare_template(src: str) -> Tuple[str, Dict[str, str], List[MacroSpan], List[str]]:
+    """Return (masked, mapping, spans, to_translate) for `src` in a single scan."""
+    mapping: Dict[str, str] = {}
+    spans: List[MacroSpan] = []
     to_translate: List[str] = []
-    spans: List[Tuple[int, int, List[Tuple[int, int, str]]]] = []
-    for m in ANY_MACRO_RE.finditer(src):
-        arg = m.group("arg").strip()
-        if (arg.startswith(("'", '"')) and arg.endswith(("'", '"'))):
-            continue  # handled by <x-hX> tags
-        # collect string literal spans in this arg
-        arg_span_literals: List[Tuple[int, int, str]] = []
-        for sm in STRING_LIT_RE.finditer(arg):
-            lit = sm.group(0)
-            try:
-                content = ast.literal_eval(lit)
-            except Exception:
-                content = lit.strip("\"'")
-            if content:
-                to_translate.append(content)
-                arg_span_literals.append((sm.start(), sm.end(), lit))
-        if arg_span_literals:
-            spans.append((m.start("arg"), m.end("arg"), arg_span_literals))
-
-    if not to_translate:
-        return src
-
-    # Translate list in one call (DeepL accepts list)
-    tgt_deepl = en_variant if target_lang.upper() == "EN" else target_lang.upper()
-    results = translator.translate_text(
-        to_translate, source_lang=source_lang.upper(), target_lang=tgt_deepl, glossary=glossary
-    )
-    translated = [r.text for r in (results if isinstance(results, list) else [results])]
 
-    # Map back in order of discovery
+    def _sub(m: re.Match) -> str:
+        if m.group("LITERAL_HEADING") is not None:
+            lvl = m.group("lvl")
+            content = _fast_unquote(m.group("string"))
+            return f"<x-h{lvl}>{content}</x-h{lvl}>"
+
+        key = f"J{len(mapping):06d}"
+        mapping[key] = m.group(0)
+        arg = m.group("arg")
+        if arg is not None and not (arg.startswith(("'", '"')) and arg.endswith(("'", '"'))):
+            # collect string literal spans in this arg
+            arg_span_literals: List[Tuple[int, int, str]] = []
+            offset = m.start("arg") - m.start()
+            for sm in STRING_LIT_RE.finditer(arg):
+                lit = sm.group(0)
+                content = _fast_unquote(lit)
+                if content.strip():  # whitespace-only literals need no translation
+                    to_translate.append(content)
+                    arg_span_literals.append((offset + sm.start(), offset + sm.end(), lit))
+            if arg_span_literals:
+                spans.append((key, arg_span_literals))
+        return f'<x-jinja data-k="{key}"></x-jinja>'
+
+    masked = TEMPLATE_RE.sub(_sub, src)
+    return masked, mapping, spans, to_translate
+
+def restore_string_literals_in_nonliteral_macros(
+    mapping: Dict[str, str],
+    spans: List[MacroSpan],
+    translated: List[str],
+) -> None:
+    """Write translations of prepare_template's `to_translate` back into the masked macros in `mapping`."""
+    # Map back in order of discovery, copying slices of each macro straight into `out`
     it = iter(translated)
-    new_src = []
-    last = 0
-    for arg_start, arg_end, lits in spans:
-        new_src.append(src[last:arg_start])
-        arg_text = src[arg_start:arg_end]
-        arg_out = []
-        a_last = 0
+    for key, lits in spans:
+        src = mapping[key]
+        out = []
+        cur = 0
         for s0, s1, lit_token in lits:
-            arg_out.append(arg_text[a_last:s0])
+            out.append(src[cur:s0])
             new_text = next(it)
             # keep original quote style
             q = lit_token[0]
             if q == "'":
                 escaped = new_text.replace("\\", "\\\\").replace("'", "\\'")
-                arg_out.append("'" + escaped + "'")
+                out.append("'" + escaped + "'")
             else:
-                arg_out.append(json.dumps(new_text))
-            a_last = s1
-        arg_out.append(arg_text[a_last:])
-        new_src.append("".join(arg_out))
-        last = arg_end
-    new_src.append(src[last:])
-    return "".join(new_src)
+                out.append(_quote(new_text))
+            cur = s1
+        out.append(src[cur:])
+        mapping[key] = "".join(out)
 
 
-# --------- 3) HTML translation via DeepL (preserve tags) ---------
+# --------- 4) HTML translation via DeepL (preserve tags) ---------
+def _reattach_whitespace(original: str, translated: str) -> str:
+    """Give `translated` the leading/trailing whitespace of `original`."""
+    head = original[: len(original) - len(original.lstrip())]
+    tail = original[len(original.rstrip()):]
+    return head + translated.strip() + tail
+
 def translate_html_with_deepl(
     html_text: str,
-    api_key: str,
+    translator: deepl.Translator,
     src: str,
     tgt: str,
     glossary: Optional[str] = None,
     en_variant: str = "EN-GB",
+    prepared: Optional[Tuple[str, Dict[str, str], List[MacroSpan], List[str]]] = None,
 ) -> str:
-    translator = deepl.Translator(api_key)
-    # translate string-literals inside non-literal heading macros first (so they survive masking)
-    html_text = translate_string_literals_in_nonliteral_macros(
-        html_text, translator, src, tgt, en_variant, glossary
-    )
-    # literal heading macros -> tags so DeepL translates their inner text
-    html_text = replace_literal_heading_macros_with_tags(html_text)
-
-    # mask the rest of Jinja
-    masked, map_jinja = mask_jinja(html_text)
+    # one scan: literal heading macros -> tags (so DeepL translates their inner text),
+    # the rest of Jinja masked, literals of non-literal heading macros collected.
+    # `prepared` is prepare_template(html_text) if the caller already ran it.
+    masked, map_jinja, spans, to_translate = prepared or prepare_template(html_text)
 
-    # translate visible text while preserving HTML tags
-    deepl_target = en_variant if tgt.upper() == "EN" else tgt.upper()
-    result = translator.translate_text(
-        masked,
+    # One request for both: the macro literals ride along as extra texts in front of
+    # the page. They go through HTML tag handling too, so escape them on the way in,
+    # and keep their surrounding whitespace (e.g. " unit") out of DeepL's hands.
+    # Repeated literals (" unit" in many headings) are sent once.
+    literal_payload = [html_escape(lit.strip(), quote=False) for lit in to_translate]
+    unique_literals = list(dict.fromkeys(literal_payload))
+    results = deepl_client.with_retry(
+        translator.translate_text,
+        unique_literals + [masked],
         source_lang=src.upper(),
-        target_lang=deepl_target,
+        target_lang=deepl_client.resolve_target_lang(tgt, en_variant),
         tag_handling="html",
         ignore_tags=["x-jinja", "script", "style", "pre", "code"],
         glossary=glossary,
     )
-    translated_masked = result.text if hasattr(result, "text") else result[0].text
+    translated_masked = results[-1].text
+    table = dict(zip(unique_literals, (r.text for r in results[:-1])))
+    translated_literals = [
+        _reattach_whitespace(lit, html_unescape(table[payload]))
+        for lit, payload in zip(to_translate, literal_payload)
+    ]
+    restore_string_literals_in_nonliteral_macros(map_jinja, spans, translated_literals)
 
     # restore Jinja and convert <x-h2>/<x-h3> back to macros
     unmasked = unmask_jinja(translated_masked, map_jinja)
@@ -202,14 +226,7 @@ def translate_html_with_deepl(
     return final_text
 
 
-# --------- 4) CLI ---------
-def find_glossary_id(translator: deepl.Translator, name: str, src: str, tgt: str) -> Optional[str]:
-    s, t = src.upper(), tgt.upper()
-    for g in translator.list_glossaries():
-        if g.name == name and g.source_lang.upper() == s and g.target_lang.upper() == t:
-            return g.glossary_id
-    return None
-
+# --------- 5) CLI ---------
 def main():
     ap = argparse.ArgumentParser("Translate a Jinja2 (.j2) template with DeepL, preserving Jinja & HTML.")
     ap.add_argument("input", help="Input .j2 file")
@@ -219,35 +236,52 @@ def main():
     ap.add_argument("--en-variant", default="EN-GB", choices=["EN-GB", "EN-US"],
                     help="If target is English, pick EN-GB or EN-US (default EN-GB)")
     ap.add_argument("--glossary", default="auto",
-                    help='Glossary name; "auto" uses epd-<SRC>-<TGT>, "none" disables.')
+                    help='Glossary name; "auto" uses epd-<SRC>-<TGT> (then <SRC>-<TGT>, <SRC>_<TGT>), "none" disables.')
     args = ap.parse_args()
 
     if "DEEPL_API_KEY" not in os.environ:
         raise SystemExit("Set DEEPL_API_KEY first.")
 
+    api_key = os.environ["DEEPL_API_KEY"]
+    translator = deepl_client.get_translator(api_key)
     inp = Path(args.input)
     outp = Path(args.output)
+
     raw = inp.read_text(encoding="utf-8")
 
-    glossary_id = None
-    if args.glossary.lower() != "none":
-        name = f"epd-{args.src.upper()}-{args.tgt.upper()}" if args.glossary.lower() == "auto" else args.glossary
-        try:
-            glossary_id = find_glossary_id(deepl.Translator(os.environ["DEEPL_API_KEY"]), name, args.src, args.tgt)
-            if glossary_id:
-                print(f"Using glossary: {name} (id={glossary_id})")
-            else:
-                print(f"Note: glossary '{name}' not found for {args.src}->{args.tgt}; continuing without it.")
-        except Exception as e:
-            print(f"Warning: could not look up glossary: {e} (continuing without).")
-
-    result = translate_html_with_deepl(
-        raw,
-        api_key=os.environ["DEEPL_API_KEY"],
-        src=args.src,
-        tgt=args.tgt,
-        glossary=glossary_id,
-        en_variant=args.en_variant,
+    # The glossary lookup may be a DeepL round trip (network wait, GIL released);
+    # mask and scan the template in the meantime.
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        glossary_fut = None
+        if args.glossary.lower() != "none":
+            names = deepl_client.glossary_candidates(args.glossary, args.src, args.tgt)
+            glossary_fut = pool.submit(deepl_client.find_first_glossary_cached, api_key, names, args.src, args.tgt)
+
+        prepared = prepare_template(raw)
+
+        found = None
+        if glossary_fut is not None:
+            try:
+                found = glossary_fut.result()
+                if found:
+                    name, glossary_id = found
+                    print(f"Using glossary: {name} (id={glossary_id})")
+                else:
+                    print(f"Note: glossary '{names[0]}' not found for {args.src}->{args.tgt}; continuing without it.")
+            except Exception as e:
+                print(f"Warning: could not look up glossary: {e} (continuing without).")
+
+    result = deepl_client.call_with_glossary(
+        lambda glossary_id: translate_html_with_deepl(
+            raw,
+            translator=translator,
+            src=args.src,
+            tgt=args.tgt,
+            glossary=glossary_id,
+            en_variant=args.en_variant,
+            prepared=prepared,
+        ),
+        api_key, found, args.src, args.tgt,
     )
     outp.write_text(result, encoding="utf-8")
     print(f"Translated → {outp}")
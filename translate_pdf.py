@@ -1,107 +1,463 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import os
+import json
+import re
+import mmap
 import sys
+import asyncio
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from html import escape
+from importlib.util import find_spec
+from functools import lru_cache
+from itertools import accumulate
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+import deepl_client
+
+# deepl, the PDF libraries and the PDF writers are imported where they are used,
+# so `--help` and argument errors return without paying for their import trees.
+if TYPE_CHECKING:
+    import deepl
+
+# Native extractors, tried in this order before falling back to PyPDF2.
+HAVE_PYMUPDF = find_spec("pymupdf") is not None  # PyMuPDF (MuPDF, C)
+HAVE_PDFIUM = find_spec("pypdfium2") is not None  # PDFium (C++)
+
+# reportlab lays out paragraphs in C and embeds TrueType fonts (non-Latin targets);
+# the FPDF core-font writer remains as the fallback.
+HAVE_REPORTLAB = find_spec("reportlab") is not None
+
+# Chunk size: start large and shrink whenever DeepL rejects a text as too large.
+# The smallest rejected size is remembered across runs, so later runs start calibrated.
+TUNING_PATH = Path.home() / ".cache" / "epd-translation" / "tuning.json"
+DEFAULT_MAX_LEN = 30_000
+MIN_MAX_LEN = 1_000
+
+# Unicode fonts for the reportlab writer, first existing one wins.
+UNICODE_FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
 
-import deepl
-from PyPDF2 import PdfReader
-from fpdf import FPDF
+# PyPDF2 extraction is pure Python and CPU-bound; spread it over processes for longer
+# documents. The native extractors finish a whole document faster than a pool starts
+# (milliseconds vs. ~0.1 s with fork, seconds with spawn), so they always run inline.
+PAGES_PER_TASK = 8     # most pages a worker extracts per task (amortizes reopening the file)
+MIN_PAGES_FOR_POOL = 4  # below this, worker startup costs more than it saves
+
+# A chunk is only worth sending if it contains a word: a run of 3+ letters, any script.
+# Page numbers, rules and symbol debris from extraction are passed through as is.
+TRANSLATABLE_RE = re.compile(r"[^\W\d_]{3,}")
+
+# Sentence boundary: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace and something that can start a sentence. Good enough for packing chunks.
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])[\"'»”)\]]*\s+(?=[\"'«„“(\[]*[A-ZÄÖÜ0-9])")
 
 
 # ---------- Helpers ----------
-def read_pdf_text(pdf_path: Path) -> str:
-    """Very simple text extraction without preserving layout."""
-    reader = PdfReader(str(pdf_path))
+def _read_pages_pymupdf(pdf_path: str, start: int, stop: int) -> List[str]:
+    import pymupdf
+
+    texts = []
+    with pymupdf.open(pdf_path) as doc:
+        for i in range(start, stop):
+            try:
+                texts.append(doc[i].get_text("text"))
+            except Exception:  # an unreadable page must not abort the document
+                texts.append("")
+    return texts
+
+
+def _read_pages_pdfium(pdf_path: str, start: int, stop: int) -> List[str]:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
     texts = []
-    for page in reader.pages:
+    try:
+        for i in range(start, stop):
+            page = pdf[i]
+            try:
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range().replace("\r\n", "\n"))
+                textpage.close()
+            except pdfium.PdfiumError:
+                texts.append("")
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return texts
+
+
+def _read_pages_pypdf2(pdf_path: str, start: int, stop: int) -> List[str]:
+    from PyPDF2 import PdfReader
+
+    # PdfReader seeks around a mapped file directly; the OS pages it in on demand
+    # instead of PyPDF2 reading the whole file into memory first.
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        reader = PdfReader(mm)
+        texts = []
+        for i in range(start, stop):
+            try:
+                texts.append(reader.pages[i].extract_text() or "")
+            except Exception:
+                texts.append("")
+    return texts
+
+
+_PAGE_READERS = {
+    "pymupdf": _read_pages_pymupdf,
+    "pdfium": _read_pages_pdfium,
+    "pypdf2": _read_pages_pypdf2,
+}
+
+
+def _page_count(backend: str, pdf_path: str) -> Optional[int]:
+    """Number of pages, or None if `backend` cannot read the file (e.g. encrypted)."""
+    if backend == "pymupdf":
+        import pymupdf
         try:
-            texts.append(page.extract_text() or "")
-        except Exception:
-            texts.append("")
-    return "\n\n".join(texts).strip()
+            with pymupdf.open(pdf_path) as doc:
+                return None if doc.needs_pass else doc.page_count
+        except RuntimeError:  # MuPDF could not parse it
+            return None
+    if backend == "pdfium":
+        import pypdfium2 as pdfium
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+        except pdfium.PdfiumError:
+            return None
+        n = len(pdf)
+        pdf.close()
+        return n
+    from PyPDF2 import PdfReader
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return len(PdfReader(mm).pages)
 
 
-def chunk_text(text: str, max_len: int = 4500) -> List[str]:
-    """Split text into manageable chunks for the API."""
-    if len(text) <= max_len:
-        return [text]
-    chunks, current = [], []
-    length = 0
-    parts = text.replace("\r", "").split("\n\n")
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-        if length + len(part) + 2 > max_len:
-            chunks.append("\n\n".join(current))
-            current = [part]
-            length = len(part)
+def _extract_pages(task: Tuple[str, str, int, int]) -> List[str]:
+    """Worker: (backend, pdf_path, start, stop) -> text of pages [start, stop)."""
+    backend, pdf_path, start, stop = task
+    return _PAGE_READERS[backend](pdf_path, start, stop)
+
+
+def iter_pdf_text(pdf_path: Path) -> Iterator[str]:
+    """Yield the text of successive runs of pages, in order, as they are extracted."""
+    path = str(pdf_path)
+    # native extractors first; PyPDF2 is the last resort
+    backends = [name for name, have in (("pymupdf", HAVE_PYMUPDF), ("pdfium", HAVE_PDFIUM)) if have]
+    for backend in backends + ["pypdf2"]:
+        n_pages = _page_count(backend, path)
+        if n_pages is not None:
+            break
+
+    workers = os.cpu_count() or 1
+    if backend != "pypdf2" or n_pages < MIN_PAGES_FOR_POOL or workers == 1:
+        yield "\n\n".join(_extract_pages((backend, path, 0, n_pages)))
+        return
+    # each worker opens the file itself and extracts a run of pages
+    step = max(1, min(PAGES_PER_TASK, -(-n_pages // workers)))  # ceil division
+    tasks = [(backend, path, i, min(i + step, n_pages)) for i in range(0, n_pages, step)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as ex:
+        for part in ex.map(_extract_pages, tasks):
+            yield "\n\n".join(part)
+
+
+def read_pdf_text(pdf_path: Path) -> str:
+    """Very simple text extraction without preserving layout."""
+    return "\n\n".join(iter_pdf_text(pdf_path)).strip()
+
+
+def split_sentences(paragraph: str, max_len: int) -> List[str]:
+    """Split an oversized paragraph into pieces of at most `max_len`, on sentence
+    boundaries where possible (hard-wrapped on whitespace otherwise)."""
+    sentences = []
+    for sent in SENTENCE_END_RE.split(paragraph):
+        while len(sent) > max_len:
+            cut = sent.rfind(" ", 0, max_len + 1)
+            if cut <= 0:
+                cut = max_len
+            sentences.append(sent[:cut].rstrip())
+            sent = sent[cut:].lstrip()
+        if sent:
+            sentences.append(sent)
+
+    # greedily pack sentences back together, one space apart
+    pieces: List[str] = []
+    current = ""
+    for sent in sentences:
+        if current and len(current) + 1 + len(sent) > max_len:
+            pieces.append(current)
+            current = sent
         else:
-            current.append(part)
-            length += len(part) + 2
+            current = f"{current} {sent}" if current else sent
     if current:
-        chunks.append("\n\n".join(current))
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(text: str, max_len: int = 4500, normalize: bool = False) -> List[str]:
+    """Split text into manageable chunks for the API.
+
+    Paragraphs are packed greedily into chunks of at most `max_len` characters;
+    a paragraph longer than that is split between sentences first. Text that
+    already fits is returned as is, unless `normalize` asks for it to be re-packed
+    like the chunks of a longer text (stripped paragraphs, one blank line apart).
+    """
+    if len(text) <= max_len and not normalize:
+        return [text]
+    parts = []
+    for p in text.replace("\r", "").split("\n\n"):
+        p = p.strip()
+        if len(p) > max_len:
+            parts.extend(split_sentences(p, max_len))
+        elif p:
+            parts.append(p)
+    # csum[i] = joined length of parts[:i + 1] plus one trailing "\n\n"; a run of parts
+    # fits in a chunk while its share of csum stays within max_len + 2
+    csum = list(accumulate(len(p) + 2 for p in parts))
+    chunks = []
+    start = 0
+    while start < len(parts):
+        base = csum[start - 1] if start else 0
+        end = bisect_right(csum, base + max_len + 2, lo=start)
+        chunks.append("\n\n".join(parts[start:end]))
+        start = end
     return chunks
 
 
-def write_pdf(text: str, out_path: Path) -> None:
-    """Create a simple PDF with the translated text (no original layout)."""
+def _iter_paragraphs(text: str) -> Iterator[str]:
+    """Yield the "\n\n"-separated paragraphs of `text` without building a list."""
+    i, n = 0, len(text)
+    while i < n:
+        j = text.find("\n\n", i)
+        if j == -1:
+            j = n
+        yield text[i:j]
+        i = j + 2
+
+
+@lru_cache(maxsize=1)
+def _unicode_font() -> str:
+    """Register the first available Unicode TTF with reportlab; Helvetica otherwise."""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    for path in UNICODE_FONT_PATHS:
+        if os.path.exists(path):
+            pdfmetrics.registerFont(TTFont("BodyUnicode", path))
+            return "BodyUnicode"
+    return "Helvetica"
+
+
+def _write_pdf_fpdf(text: str, out_path: Path) -> None:
+    from fpdf import FPDF
+
     pdf = FPDF()  # A4 default
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
     pdf.set_font("Helvetica", size=12)
-    for paragraph in text.split("\n\n"):
+    for paragraph in _iter_paragraphs(text):
         if not paragraph.strip():
             continue
+        # the core fonts are latin-1 only; substitute anything else up front
+        paragraph = paragraph.encode("latin-1", "replace").decode("latin-1")
         pdf.multi_cell(w=0, h=6, txt=paragraph)
         pdf.ln(2)
     pdf.output(str(out_path))
 
 
-def resolve_target_lang(tgt: str, en_variant: str) -> str:
-    """DeepL uses EN-GB/EN-US for English; other languages are just their code."""
-    t = tgt.upper()
-    if t == "EN":
-        return en_variant.upper()  # EN-GB or EN-US
-    return t
+_max_len: Optional[int] = None
+
 
+def _chunk_max_len() -> int:
+    """Current chunk budget: the persisted value, else DEFAULT_MAX_LEN."""
+    global _max_len
+    if _max_len is None:
+        try:
+            _max_len = max(MIN_MAX_LEN, int(json.loads(TUNING_PATH.read_text())["max_len"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            _max_len = DEFAULT_MAX_LEN
+    return _max_len
 
-def find_glossary(translator: deepl.Translator, name: str, src: str, tgt: str) -> Optional[str]:
-    """Return glossary_id if a glossary with this name and language pair exists."""
-    s = src.upper()
-    t = tgt.upper()
-    for g in translator.list_glossaries():
-        if g.name == name and g.source_lang.upper() == s and g.target_lang.upper() == t:
-            return g.glossary_id
-    return None
 
+def _shrink_max_len(rejected: int) -> None:
+    """Record that a text of `rejected` characters was too large for one request."""
+    global _max_len
+    new = max(MIN_MAX_LEN, rejected // 2)
+    if new >= _chunk_max_len():
+        return
+    _max_len = new
+    try:
+        TUNING_PATH.parent.mkdir(parents=True, exist_ok=True)
+        TUNING_PATH.write_text(json.dumps({"max_len": new}))
+    except OSError:
+        pass  # only a hint for the next run
 
-def translate_text(
+
+def write_pdf(text: str, out_path: Path) -> None:
+    """Create a simple PDF with the translated text (no original layout)."""
+    if not HAVE_REPORTLAB:
+        _write_pdf_fpdf(text, out_path)
+        return
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate
+
+    style = getSampleStyleSheet()["BodyText"]
+    style.fontName = _unicode_font()
+    style.fontSize = 12
+    style.leading = 17  # ~6 mm, as in the FPDF layout
+    style.spaceAfter = 2 * mm
+    doc = SimpleDocTemplate(
+        str(out_path), pagesize=A4,
+        leftMargin=10 * mm, rightMargin=10 * mm, topMargin=15 * mm, bottomMargin=15 * mm,
+    )
+    # Paragraph takes reportlab's XML markup, so escape the text first
+    story = [
+        Paragraph(escape(p.strip()).replace("\n", "<br/>"), style)
+        for p in _iter_paragraphs(text) if p.strip()
+    ]
+    doc.build(story)
+
+
+def _split_rejected(text: str) -> List[str]:
+    """`text` is too large for one request (413, or over the byte budget): shrink the chunk budget and re-chunk it."""
+    _shrink_max_len(len(text))
+    return chunk_text(text, max_len=len(text) // 2)
+
+
+async def _translate_chunks(
+    chunks: List[str],
+    translator: deepl.Translator,
+    src: str,
+    deepl_target: str,
+    glossary_id: Optional[str],
+    concurrency: int,
+    sem: asyncio.Semaphore,
+) -> List[str]:
+    """Translate `chunks` (same order out), with at most `sem` requests in flight."""
+    # chunks without words are kept as is; identical chunks (repeated boilerplate
+    # pages) are translated once, and earlier runs' chunks come from the cache
+    table = {ch: ch for ch in chunks if not TRANSLATABLE_RE.search(ch)}
+    table.update(await deepl_client.translate_many_async(
+        [ch for ch in chunks if ch not in table], translator, src, deepl_target, glossary_id,
+        sem=sem, concurrency=concurrency, split=_split_rejected,
+    ))
+    return [table[ch] for ch in chunks]
+
+
+async def _translate_text_async(
     text: str,
-    api_key: str,
+    translator: deepl.Translator,
     src: str,
     tgt: str,
     glossary_id: Optional[str],
     en_variant: str,
+    concurrency: int,
 ) -> str:
-    """Translate using DeepL, optionally applying a glossary."""
-    translator = deepl.Translator(api_key)
-    deepl_target = resolve_target_lang(tgt, en_variant)
-    chunks = chunk_text(text, max_len=4500)
-    out: List[str] = []
-    for ch in chunks:
-        res = translator.translate_text(
-            ch,
-            source_lang=src.upper(),
-            target_lang=deepl_target,
-            glossary=glossary_id,  # None is fine if not found
-        )
-        out.append(res.text if hasattr(res, "text") else res[0].text)
+    concurrency = max(1, concurrency)
+    sem = asyncio.Semaphore(concurrency)  # bounds requests in flight
+    out = await _translate_chunks(
+        chunk_text(text, max_len=_chunk_max_len()), translator, src,
+        deepl_client.resolve_target_lang(tgt, en_variant), glossary_id, concurrency, sem,
+    )
     return "\n\n".join(out)
 
 
+async def _translate_pdf_async(
+    pdf_path: Path,
+    translator: deepl.Translator,
+    src: str,
+    tgt: str,
+    glossary_id: Optional[str],
+    en_variant: str,
+    concurrency: int,
+) -> Tuple[str, str]:
+    concurrency = max(1, concurrency)
+    sem = asyncio.Semaphore(concurrency)  # shared by all runs of pages
+    deepl_target = deepl_client.resolve_target_lang(tgt, en_variant)
+    pages = iter_pdf_text(pdf_path)
+    runs: List[str] = []
+    tasks = []
+
+    def dispatch(chunks: List[str]) -> None:
+        tasks.append(asyncio.create_task(_translate_chunks(
+            chunks, translator, src, deepl_target, glossary_id, concurrency, sem
+        )))
+
+    # Extraction is pulled from a worker thread so the event loop keeps sending
+    # requests while the next run of pages is still being extracted. Only chunks
+    # that later text can no longer extend are sent; the last (possibly unfinished)
+    # one is carried into the next run, so the chunks are exactly those of
+    # chunk_text(read_pdf_text(...)), however the pool splits the pages. The budget is
+    # re-read per run, so once a 413 shrinks it the rest of the document uses the new size.
+    carry = ""
+    overflowed = False  # once the text exceeds one chunk, every chunk is re-packed
+    while True:
+        run = await asyncio.to_thread(next, pages, None)
+        if run is None:
+            break
+        runs.append(run)
+        max_len = _chunk_max_len()
+        carry = f"{carry}\n\n{run}" if runs[1:] else run
+        if len(carry.strip()) <= max_len:
+            continue  # might still be the whole document
+        chunks = chunk_text(carry.strip(), max_len=max_len)
+        overflowed = True
+        if len(chunks) > 1:
+            dispatch(chunks[:-1])
+        carry = chunks[-1]
+    if carry.strip():
+        dispatch(chunk_text(carry.strip(), max_len=_chunk_max_len(), normalize=overflowed))
+
+    translated = await asyncio.gather(*tasks, return_exceptions=True)
+    deepl_client.raise_first(translated)
+    return "\n\n".join(runs).strip(), "\n\n".join(t for part in translated for t in part)
+
+
+def translate_text(
+    text: str,
+    translator: deepl.Translator,
+    src: str,
+    tgt: str,
+    glossary_id: Optional[str],
+    en_variant: str,
+    concurrency: int = deepl_client.MAX_PARALLEL_REQUESTS,
+) -> str:
+    """Translate using DeepL, optionally applying a glossary.
+
+    Chunks are spread over up to `concurrency` requests sent in parallel, so the
+    wall time is roughly that of the slowest request rather than the sum of all.
+    """
+    return asyncio.run(_translate_text_async(
+        text, translator, src, tgt, glossary_id, en_variant, concurrency
+    ))
+
+
+def translate_pdf(
+    pdf_path: Path,
+    translator: deepl.Translator,
+    src: str,
+    tgt: str,
+    glossary_id: Optional[str],
+    en_variant: str,
+    concurrency: int = deepl_client.MAX_PARALLEL_REQUESTS,
+) -> Tuple[str, str]:
+    """Extract and translate a PDF, overlapping the two; returns (original, translated)."""
+    return asyncio.run(_translate_pdf_async(
+        pdf_path, translator, src, tgt, glossary_id, en_variant, concurrency
+    ))
+
+
 # ---------- CLI ----------
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(
@@ -121,20 +477,27 @@ def parse_args() -> argparse.Namespace:
         "--glossary",
         default="auto",
         help=(
-            'Glossary name to use. Default "auto" looks for epd-<SRC>-<TGT>. '
+            'Glossary name to use. Default "auto" looks for epd-<SRC>-<TGT>, '
+            'then <SRC>-<TGT> and <SRC>_<TGT>. '
             'Use "none" to skip glossaries.'
         ),
     )
+    p.add_argument(
+        "--concurrency",
+        type=int,
+        default=deepl_client.MAX_PARALLEL_REQUESTS,
+        help=f"Maximum DeepL requests in flight at once. Default: {deepl_client.MAX_PARALLEL_REQUESTS}",
+    )
     return p.parse_args()
 
 
 def main():
+    args = parse_args()  # first, so --help and usage errors never wait on anything else
+
     if "DEEPL_API_KEY" not in os.environ:
         print("Error: Please set the DEEPL_API_KEY environment variable.")
         sys.exit(1)
     api_key = os.environ["DEEPL_API_KEY"]
-
-    args = parse_args()
     folder = Path(args.folder).expanduser().resolve()
     if not folder.exists() or not folder.is_dir():
         print(f"Error: Folder not found: {folder}")
@@ -157,34 +520,28 @@ def main():
     tgt = args.tgt.upper()
     en_variant = args.en_variant.upper()
 
-    print(f"Reading PDF: {pdf_in.name}")
-    original_text = read_pdf_text(pdf_in)
-    if not original_text.strip():
-        print("Warning: No text extracted (scanned PDFs or unusual layout?).")
-        print("A blank/short target PDF will still be created.")
-    else:
-        print(f"Extracted characters: {len(original_text)}")
-
     # Resolve glossary
     glossary_id = None
-    glossary_name = None
     if args.glossary.lower() != "none":
-        glossary_name = (
-            args.glossary if args.glossary.lower() != "auto" else f"epd-{src}-{tgt}"
-        )
+        names = deepl_client.glossary_candidates(args.glossary, src, tgt)
         try:
-            gid = find_glossary(deepl.Translator(api_key), glossary_name, src, tgt)
-            if gid:
-                glossary_id = gid
-                print(f"Using glossary: {glossary_name} (id={gid})")
+            found = deepl_client.find_first_glossary(api_key, names, src, tgt)
+            if found:
+                glossary_name, glossary_id = found
+                print(f"Using glossary: {glossary_name} (id={glossary_id})")
             else:
-                print(f"Note: glossary '{glossary_name}' not found for {src}->{tgt}; continuing without it.")
+                print(f"Note: glossary '{names[0]}' not found for {src}->{tgt}; continuing without it.")
         except Exception as e:
-            print(f"Warning: failed to look up glossary '{glossary_name}': {e}. Continuing without it.")
+            print(f"Warning: failed to look up glossary '{names[0]}': {e}. Continuing without it.")
 
-    # Translate
-    print(f"Translating ({src} → {tgt}) with DeepL…")
-    translated = translate_text(original_text, api_key, src=src, tgt=tgt, glossary_id=glossary_id, en_variant=en_variant) if original_text else ""
+    # Extract + translate (pages are translated while later ones are still being read)
+    print(f"Reading and translating PDF: {pdf_in.name} ({src} → {tgt}) with DeepL…")
+    original_text, translated = translate_pdf(pdf_in, deepl_client.get_translator(api_key), src=src, tgt=tgt, glossary_id=glossary_id, en_variant=en_variant, concurrency=args.concurrency)
+    if not original_text:
+        print("Warning: No text extracted (scanned PDFs or unusual layout?).")
+        print("A blank/short target PDF will still be created.")
+    else:
+        print(f"Extracted characters: {len(original_text)}")
 
     # Output
     out_name = f"{pdf_in.stem}_translated_{tgt.lower()}.pdf"
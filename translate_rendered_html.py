@@ -2,34 +2,51 @@
 # Translate already-rendered HTML (no Jinja left) using DeepL.
 from __future__ import annotations
 import os
+import re
 import argparse
-from typing import Optional
-import deepl
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import deepl  # imported lazily, so `--help` doesn't pay for it
+
+import deepl_client
 
 IGNORE_TAGS = ["script", "style", "code", "pre"]  # extend if needed
 
-def _resolve_target(tgt: str, en_variant: str) -> str:
-    return en_variant if tgt.upper() == "EN" else tgt.upper()
+# Ignored blocks are cut out before sending and spliced back afterwards, so DeepL
+# (and the translation memory) only ever sees the translatable HTML.
+PLACEHOLDER_TAG = "x-nt"
+IGNORED_BLOCK_RE = re.compile(
+    r"<(%s)\b[^>]*>.*?</\1\s*>" % "|".join(IGNORE_TAGS), re.IGNORECASE | re.DOTALL
+)
+PLACEHOLDER_RE = re.compile(r'<%s i="(\d+)"\s*>\s*</%s>' % (PLACEHOLDER_TAG, PLACEHOLDER_TAG))
+
+def stash_ignored(html: str) -> Tuple[str, List[str]]:
+    """Replace each ignored block with an empty placeholder element."""
+    stash: List[str] = []
+
+    def _repl(m: re.Match) -> str:
+        stash.append(m.group(0))
+        return f'<{PLACEHOLDER_TAG} i="{len(stash) - 1}"></{PLACEHOLDER_TAG}>'
+
+    return IGNORED_BLOCK_RE.sub(_repl, html), stash
 
-def find_glossary_id(translator: deepl.Translator, name: str, src: str, tgt: str) -> Optional[str]:
-    s, t = src.upper(), tgt.upper()
-    for g in translator.list_glossaries():
-        if g.name == name and g.source_lang.upper() == s and g.target_lang.upper() == t:
-            return g.glossary_id
-    return None
+def unstash_ignored(html: str, stash: List[str]) -> str:
+    return PLACEHOLDER_RE.sub(lambda m: stash[int(m.group(1))], html)
 
-def translate_rendered_html(html: str, *, api_key: str, src: str, tgt: str,
+def translate_rendered_html(html: str, *, translator: deepl.Translator, src: str, tgt: str,
                             glossary_id: Optional[str] = None, en_variant: str = "EN-GB") -> str:
-    tr = deepl.Translator(api_key)
-    result = tr.translate_text(
-        html,
-        source_lang=src.upper(),
-        target_lang=_resolve_target(tgt, en_variant),
+    target = deepl_client.resolve_target_lang(tgt, en_variant)
+    ignore_tags = IGNORE_TAGS + [PLACEHOLDER_TAG]
+    stripped, stash = stash_ignored(html)
+    # re-running on an unchanged page is served from the local translation memory
+    translated = deepl_client.translate_many(
+        [stripped], translator, src, target, glossary_id,
+        options="html:" + ",".join(ignore_tags),
         tag_handling="html",
-        ignore_tags=IGNORE_TAGS,     # HTML structure preserved; code/css ignored
-        glossary=glossary_id,        # OK if None
-    )
-    return result.text if hasattr(result, "text") else result[0].text
+        ignore_tags=ignore_tags,     # HTML structure preserved; code/css ignored
+    )[0]
+    return unstash_ignored(translated, stash)
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser("Translate a rendered HTML file with DeepL.")
@@ -37,7 +54,7 @@ if __name__ == "__main__":
     p.add_argument("output_html")
     p.add_argument("--src", default="EN")
     p.add_argument("--tgt", default="DE")
-    p.add_argument("--glossary", default="auto", help='Use "auto" for epd-<SRC>-<TGT>, or "none".')
+    p.add_argument("--glossary", default="auto", help='Use "auto" for epd-<SRC>-<TGT> (then <SRC>-<TGT>, <SRC>_<TGT>), or "none".')
     p.add_argument("--en-variant", default="EN-GB", choices=["EN-GB", "EN-US"])
     args = p.parse_args()
 
@@ -47,18 +64,19 @@ if __name__ == "__main__":
 
     glossary_id = None
     if args.glossary.lower() != "none":
-        name = f"epd-{args.src.upper()}-{args.tgt.upper()}" if args.glossary.lower() == "auto" else args.glossary
+        names = deepl_client.glossary_candidates(args.glossary, args.src, args.tgt)
         try:
-            glossary_id = find_glossary_id(deepl.Translator(api_key), name, args.src, args.tgt)
-            if glossary_id:
+            found = deepl_client.find_first_glossary(api_key, names, args.src, args.tgt)
+            if found:
+                name, glossary_id = found
                 print(f"Using glossary {name} ({args.src}->{args.tgt})")
             else:
-                print(f"Note: glossary '{name}' not found; continuing without.")
+                print(f"Note: glossary '{names[0]}' not found; continuing without.")
         except Exception as e:
             print(f"Glossary lookup failed: {e} (continuing without).")
 
     html = open(args.input_html, "r", encoding="utf-8").read()
-    out = translate_rendered_html(html, api_key=api_key, src=args.src, tgt=args.tgt,
+    out = translate_rendered_html(html, translator=deepl_client.get_translator(api_key), src=args.src, tgt=args.tgt,
                                   glossary_id=glossary_id, en_variant=args.en_variant)
     open(args.output_html, "w", encoding="utf-8").write(out)
     print(f"Translated → {args.output_html}")
\ No newline at end of file